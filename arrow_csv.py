@@ -0,0 +1,12 @@
+import csv
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# Function to read a CSV file
+def read_csv_arrow(path):
+    """Reads a CSV with pyarrow's multithreaded parser, keeping every column as text."""
+    with open(path, newline="", encoding="utf-8") as f:
+        names = next(csv.reader(f))
+    convert_options = pacsv.ConvertOptions(column_types=dict.fromkeys(names, pa.string()), strings_can_be_null=True)
+    return pacsv.read_csv(path, convert_options=convert_options).to_pandas(types_mapper=pd.ArrowDtype)
\ No newline at end of file
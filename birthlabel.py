@@ -1,8 +1,12 @@
+import asyncio
+import csv
 import logging
+import httpx
 import pandas as pd
-import requests
 import time
+from collections import deque
 from pathlib import Path
+from arrow_csv import read_csv_arrow
 
 # Configure logging
 logging.basicConfig(
@@ -15,30 +19,59 @@ logger = logging.getLogger(__name__)
 # Constants
 WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
 MAX_RETRIES = 5
-REQUEST_DELAY = 1  # seconds between requests to avoid rate limiting
 BATCH_SIZE = 50  # default batch size, will fall back to single requests if needed
+HEADERS = {"User-Agent": "wiki_project/1.0"}  # httpx advertises every compression it can decode
+RESULT_COLUMNS = ['birthplace_id', 'label']
+QID_PATTERN = r'^Q\d+$'
+
+class RateLimiter:
+    """Sliding-window limiter shared by all requests so concurrent batches respect the API rate limit"""
+    MAX_REQUESTS = 5  # requests allowed per window
+    WINDOW = 1.0  # seconds
+
+    def __init__(self, client):
+        self.client = client
+        self.sent_at = deque()
+
+    async def get(self, *args, **kwargs):
+        await self.wait_for_slot()
+        return await self.client.get(*args, **kwargs)
+
+    async def wait_for_slot(self):
+        """Return immediately while under the limit, otherwise sleep until the oldest request leaves the window"""
+        while True:
+            now = time.monotonic()
+            while self.sent_at and now - self.sent_at[0] >= self.WINDOW:
+                self.sent_at.popleft()
+            if len(self.sent_at) < self.MAX_REQUESTS:
+                self.sent_at.append(now)
+                return
+            await asyncio.sleep(self.WINDOW - (now - self.sent_at[0]))
+
+def extract_birthplace_ids(birthplace_urls):
+    """Normalize birthplace entity URLs to bare uppercase QIDs"""
+    return birthplace_urls.str.replace(r'.*/', '', regex=True).str.strip().str.upper()
 
 def load_or_create_dataframe(input_csv, output_csv):
     """Load existing results or create new file if doesn't exist"""
     try:
         if Path(output_csv).exists():
-            df = pd.read_csv(output_csv)
-            logger.info(f"Loaded existing results from {output_csv}")
+            df = read_csv_arrow(output_csv)
+            logger.info("Loaded existing results from %s", output_csv)
             return df
     except Exception as e:
-        logger.warning(f"Error loading {output_csv}, creating new file: {e}")
+        logger.warning("Error loading %s, creating new file: %s", output_csv, e)
     
     # Create new empty dataframe with expected columns
-    return pd.DataFrame(columns=['birthplace_id', 'label'])
+    return pd.DataFrame(columns=RESULT_COLUMNS)
 
-def get_single_label(entity_id, retries=MAX_RETRIES):
+async def get_single_label(limiter, entity_id, retries=MAX_RETRIES):
     """Fetch label for a single Wikidata entity with retries"""
     for attempt in range(retries):
         try:
-            time.sleep(REQUEST_DELAY)  # Be gentle with the API
-            logger.debug(f"Fetching label for {entity_id} (attempt {attempt + 1})")
-            
-            response = requests.get(
+            logger.debug("Fetching label for %s (attempt %d)", entity_id, attempt + 1)
+
+            response = await limiter.get(
                 WIKIDATA_API_URL,
                 params={
                     'action': 'wbgetentities',
@@ -47,7 +80,7 @@ def get_single_label(entity_id, retries=MAX_RETRIES):
                     'languages': 'en',
                     'props': 'labels'
                 },
-                timeout=10
+                timeout=httpx.Timeout(10.0, connect=5.0)
             )
             response.raise_for_status()
             data = response.json()
@@ -57,26 +90,25 @@ def get_single_label(entity_id, retries=MAX_RETRIES):
                 return entity_data['labels']['en']['value']
             return None
 
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Attempt {attempt + 1} failed for {entity_id}: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.warning("Attempt %d failed for %s: %s", attempt + 1, entity_id, e)
             if attempt == retries - 1:
-                logger.error(f"Failed to fetch {entity_id} after {retries} attempts")
+                logger.error("Failed to fetch %s after %d attempts", entity_id, retries)
                 return None
-            time.sleep(2 ** attempt)  # Exponential backoff
+            await asyncio.sleep(2 ** attempt)  # Exponential backoff
 
     return None
 
-def get_batch_labels(entity_ids, retries=MAX_RETRIES):
+async def get_batch_labels(limiter, entity_ids, retries=MAX_RETRIES):
     """Fetch labels for a batch of IDs with fallback to single requests"""
     # First try batch request
     batch_result = {}
     missing_ids = []
-    
+
     try:
-        time.sleep(REQUEST_DELAY)
-        logger.info(f"Attempting batch request for {len(entity_ids)} items")
-        
-        response = requests.get(
+        logger.info("Attempting batch request for %d items", len(entity_ids))
+
+        response = await limiter.get(
             WIKIDATA_API_URL,
             params={
                 'action': 'wbgetentities',
@@ -84,9 +116,8 @@ def get_batch_labels(entity_ids, retries=MAX_RETRIES):
                 'format': 'json',
                 'languages': 'en',
                 'props': 'labels'
-            },
-            timeout=20  # Longer timeout for batches
-        )
+            }
+        )  # Uses the client's longer default timeout for batches
         response.raise_for_status()
         data = response.json()
 
@@ -97,106 +128,113 @@ def get_batch_labels(entity_ids, retries=MAX_RETRIES):
             else:
                 batch_result[entity_id] = None
                 missing_ids.append(entity_id)
-                
-        logger.info(f"Batch succeeded with {len(entity_ids) - len(missing_ids)} labels found")
-        
+
+        logger.info("Batch succeeded with %d labels found", len(entity_ids) - len(missing_ids))
+
     except Exception as e:
-        logger.warning(f"Batch request failed: {str(e)}")
+        logger.warning("Batch request failed: %s", e)
         missing_ids = entity_ids  # If batch fails, try all individually
         batch_result = {id: None for id in entity_ids}
-    
+
     # Process missing IDs individually
     if missing_ids:
-        logger.info(f"Processing {len(missing_ids)} items individually")
-        for entity_id in missing_ids:
-            label = get_single_label(entity_id)
-            batch_result[entity_id] = label
-    
+        logger.info("Processing %d items individually", len(missing_ids))
+        labels = await asyncio.gather(*(get_single_label(limiter, entity_id) for entity_id in missing_ids))
+        batch_result.update(zip(missing_ids, labels))
+
     return batch_result
 
+async def process_batch(limiter, batch, batch_number):
+    """Fetch labels for one batch, falling back to individual requests on fatal errors"""
+    try:
+        return batch, await get_batch_labels(limiter, batch)
+    except Exception as e:
+        logger.error("Fatal error processing batch %d: %s", batch_number, e)
+        logger.info("Attempting to process items individually...")
+
+    # Fall back to individual processing
+    batch_labels = {}
+    for entity_id in batch:
+        try:
+            batch_labels[entity_id] = await get_single_label(limiter, entity_id)
+        except Exception as single_e:
+            logger.error("Failed to process %s: %s", entity_id, single_e)
+            batch_labels[entity_id] = None  # Store as None to indicate failure
+    return batch, batch_labels
+
+async def fetch_all_labels(ids_to_process, output_csv):
+    """Fetch all batches concurrently, appending results to disk as each batch completes"""
+    saved = 0
+    with open(output_csv, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(RESULT_COLUMNS)
+
+        async with httpx.AsyncClient(http2=True, headers=HEADERS, timeout=httpx.Timeout(20.0, connect=5.0)) as client:
+            limiter = RateLimiter(client)
+            tasks = [
+                process_batch(limiter, ids_to_process[i:i + BATCH_SIZE], i // BATCH_SIZE + 1)
+                for i in range(0, len(ids_to_process), BATCH_SIZE)
+            ]
+
+            for completed in asyncio.as_completed(tasks):
+                batch, batch_labels = await completed
+
+                # Append only this batch so earlier results are never rewritten
+                writer.writerows((id, batch_labels.get(id)) for id in batch)
+                f.flush()
+                saved += len(batch)
+                logger.info("Saved results for %d birthplaces", saved)
+
+    return saved
+
 def process_all_birthplaces(dataset_path, output_csv):
     """Main function to process all birthplaces directly from the dataset"""
-    # Load existing results
+    # Load existing results, only needed to skip IDs when resuming
     results_df = load_or_create_dataframe(None, output_csv)
-    processed_ids = set(results_df['birthplace_id'].astype(str))
+    processed_ids = pd.Index(results_df['birthplace_id'].dropna())
+    del results_df
     
-    # Load dataset and extract birthplace URLs
-    df = pd.read_csv(dataset_path)
-    df['birthplace_id'] = df['birthplace'].apply(
-        lambda x: x.split('/')[-1] if isinstance(x, str) else None
-    )
-    all_ids = df['birthplace_id'].dropna().unique().tolist()
+    # Load dataset and extract normalized birthplace IDs from the URLs
+    df = read_csv_arrow(dataset_path)
+    df['birthplace_id'] = extract_birthplace_ids(df['birthplace'])
+    all_ids = pd.Index(df['birthplace_id'].dropna()).unique()
+
+    # Drop anything that is not a QID so it never reaches the API
+    valid = all_ids.str.match(QID_PATTERN)
+    if not valid.all():
+        rejected = all_ids[~valid]
+        logger.warning("Skipping %d invalid birthplace IDs, e.g. %s", len(rejected), rejected[:5].tolist())
+        all_ids = all_ids[valid]
     
     # Determine which IDs need processing
-    ids_to_process = [id for id in all_ids if str(id) not in processed_ids]
-    logger.info(f"IDs to process: {ids_to_process}")
-    logger.info(f"Total IDs to process: {len(ids_to_process)} (already have {len(processed_ids)})")
+    ids_to_process = all_ids.difference(processed_ids, sort=False).tolist()
+    logger.debug("IDs to process: %d items", len(ids_to_process))
+    logger.info("Total IDs to process: %d (already have %d)", len(ids_to_process), len(processed_ids))
     
-    # Process in batches with progress saving
-    for i in range(0, len(ids_to_process), BATCH_SIZE):
-        batch = ids_to_process[i:i + BATCH_SIZE]
-        logger.info(f"Processing batch {i//BATCH_SIZE + 1} (IDs {i} to {i + len(batch) - 1})")
-        
-        try:
-            batch_labels = get_batch_labels(batch)
-            
-            # Create dataframe for this batch's results
-            batch_df = pd.DataFrame({
-                'birthplace_id': batch,
-                'label': [batch_labels.get(id, None) for id in batch]
-            })
-            
-            # Append to results and save
-            results_df = pd.concat([results_df, batch_df], ignore_index=True)
-            results_df.to_csv(output_csv, index=False)
-            logger.info(f"Saved results for batch {i//BATCH_SIZE + 1}")
-            
-        except Exception as e:
-            logger.error(f"Fatal error processing batch {i//BATCH_SIZE + 1}: {str(e)}")
-            logger.info("Attempting to process items individually...")
-            
-            # Fall back to individual processing
-            for entity_id in batch:
-                try:
-                    label = get_single_label(entity_id)
-                    new_row = pd.DataFrame({
-                        'birthplace_id': [entity_id],
-                        'label': [label]
-                    })
-                    results_df = pd.concat([results_df, new_row], ignore_index=True)
-                    results_df.to_csv(output_csv, index=False)
-                except Exception as single_e:
-                    logger.error(f"Failed to process {entity_id}: {str(single_e)}")
-                    # Store as None to indicate failure
-                    new_row = pd.DataFrame({
-                        'birthplace_id': [entity_id],
-                        'label': [None]
-                    })
-                    results_df = pd.concat([results_df, new_row], ignore_index=True)
-                    results_df.to_csv(output_csv, index=False)
+    # Process batches concurrently; the rate limiter paces requests globally
+    saved = asyncio.run(fetch_all_labels(ids_to_process, output_csv))
     
-    logger.info(f"Processing complete. Results saved to {output_csv}")
-    return results_df
+    logger.info("Processing complete. %d new results saved to %s", saved, output_csv)
+    return saved
 
 def merge_labels_to_dataset(dataset_path, labels_path, output_path):
     """Merge the fetched labels back into the original dataset"""
     logger.info("Merging labels with original dataset")
     
     # Load datasets
-    df = pd.read_csv(dataset_path)
-    labels_df = pd.read_csv(labels_path)
+    df = read_csv_arrow(dataset_path)
+    labels_df = read_csv_arrow(labels_path)
     
     # Extract birthplace IDs from original dataset
-    df['birthplace_id'] = df['birthplace'].apply(
-        lambda x: x.split('/')[-1] if isinstance(x, str) else None
-    )
+    df['birthplace_id'] = extract_birthplace_ids(df['birthplace'])
     
     # Merge labels
     merged_df = df.merge(labels_df, on='birthplace_id', how='left')
     
     # Save result
     merged_df.to_csv(output_path, index=False)
-    logger.info(f"Merged dataset saved to {output_path}")
+    logger.info("Merged dataset saved to %s", output_path)
     return merged_df
 
 if __name__ == "__main__":
@@ -1,55 +1,130 @@
 import requests
 import pandas as pd
+import pyarrow as pa
 import time
 import os
-from datetime import datetime
+import glob
 import logging
+from requests.adapters import HTTPAdapter
+from arrow_csv import read_csv_arrow
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 # Configuration
-BATCH_SIZE = 1000
+BATCH_SIZE = 50  # Wikidata IDs per request (the wbgetentities maximum)
 MAX_RETRIES = 10
 RETRY_DELAY = 20
 TIMEOUT = 300
 SAVE_EVERY_N_BATCHES = 50
-WIKIDATA_URL = "https://query.wikidata.org/sparql"
+RESULTS_PREFIX = "missing_persons_results"
+WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
+ENTITY_URI = "http://www.wikidata.org/entity/"
+RESULT_SCHEMA = pa.schema([
+    (name, pa.string())
+    for name in ["person", "personLabel", "birthdate", "birthplace", "placeOfDeath", "birthplaceCoordinates"]
+])
 HEADERS = {
-    "Accept": "application/sparql-results+json",
+    "Accept": "application/json",
     "User-Agent": "wiki_german_de/1.0 (soc.evgeniiatcoi@gmail.com)",
     "Accept-Encoding": "gzip,deflate"
 }
 
-# Function to query Wikidata
-def query_wikidata(query, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY, timeout=TIMEOUT):
+# Shared session so repeated queries reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=0))
+_SESSION.headers.update(HEADERS)
+
+# Function to fetch a batch of entities from the Wikidata API
+def get_entities(entity_ids, props, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY, timeout=TIMEOUT):
     for attempt in range(max_retries):
         try:
-            logger.info(f"Attempt {attempt + 1}/{max_retries}: Querying Wikidata...")
-            response = requests.get(WIKIDATA_URL, headers=HEADERS, params={"query": query}, timeout=timeout)
+            logger.info("Attempt %d/%d: Fetching %d entities from Wikidata...", attempt + 1, max_retries, len(entity_ids))
+            response = _SESSION.get(
+                WIKIDATA_API_URL,
+                params={
+                    "action": "wbgetentities",
+                    "ids": "|".join(entity_ids),
+                    "format": "json",
+                    "languages": "de",
+                    "props": props
+                },
+                timeout=timeout
+            )
             response.raise_for_status()
-
             data = response.json()
-            results = data.get("results", {}).get("bindings", [])
-
-            if results:
-                return pd.DataFrame.from_records(results)
-            else:
-                return pd.DataFrame()  # Return an empty DataFrame if no results
+            if "error" in data:  # Invalid requests are answered with 200 and an error body; retrying will not help
+                logger.error("Wikidata API error: %s", data["error"].get("info", data["error"]))
+                return None
+            return data.get("entities", {})
 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Request error (Attempt {attempt + 1}/{max_retries}): {e}")
+            logger.error("Request error (Attempt %d/%d): %s", attempt + 1, max_retries, e)
             time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
 
     logger.error("Max retries reached. Unable to fetch data.")
     return None
 
+# Function to read the values of a claim
+def get_claim_values(entity, prop):
+    """
+    Returns the best-ranked values of a claim, matching the truthy wdt: statements of SPARQL.
+    """
+    statements = [st for st in entity.get("claims", {}).get(prop, []) if st.get("rank") != "deprecated"]
+    preferred = [st for st in statements if st.get("rank") == "preferred"]
+    return [
+        st["mainsnak"]["datavalue"]["value"]
+        for st in preferred or statements
+        if st.get("mainsnak", {}).get("snaktype") == "value"
+    ]
+
+# Function to format a time value like the SPARQL query did
+def format_time(value):
+    """
+    Drops the leading "+" and replaces the 00 month or day of year- and month-precision dates with 01.
+    """
+    date, _, clock = value["time"].lstrip("+").partition("T")
+    year, month, day = date.rsplit("-", 2)
+    precision = value.get("precision", 11)
+    if precision < 10 and month == "00":
+        month = "01"
+    if precision < 11 and day == "00":
+        day = "01"
+    return f"{year}-{month}-{day}T{clock}"
+
+# Function to turn person entities into result rows
+def build_person_rows(persons, places):
+    """
+    Builds one row per person in the format previously returned by the SPARQL query.
+    """
+    rows = []
+    for entity in persons.values():
+        birthdates = get_claim_values(entity, "P569")
+        birthplaces = get_claim_values(entity, "P19")
+        if not birthdates or not birthplaces:  # Birthdate and birthplace are required
+            continue
+
+        birthplace_id = birthplaces[0]["id"]
+        places_of_death = get_claim_values(entity, "P20")
+        coordinates = get_claim_values(places.get(birthplace_id, {}), "P625")
+        rows.append({
+            "person": ENTITY_URI + entity["id"],
+            "personLabel": entity.get("labels", {}).get("de", {}).get("value", entity["id"]),
+            "birthdate": format_time(birthdates[0]),
+            "birthplace": ENTITY_URI + birthplace_id,
+            "placeOfDeath": ENTITY_URI + places_of_death[0]["id"] if places_of_death else None,
+            "birthplaceCoordinates": (
+                f"Point({coordinates[0]['longitude']} {coordinates[0]['latitude']})" if coordinates else None
+            )
+        })
+    return rows
+
 # Function to save the ID pointer
 def save_pointer(pointer, filename="id_pointer.txt"):
     with open(filename, "w") as f:
         f.write(pointer)
-    logger.info(f"Pointer saved: {pointer}")
+    logger.info("Pointer saved: %s", pointer)
 
 # Function to load the ID pointer
 def load_pointer(filename="id_pointer.txt"):
@@ -57,46 +132,59 @@ def load_pointer(filename="id_pointer.txt"):
         if os.path.exists(filename):
             with open(filename, "r") as f:
                 pointer = f.read().strip()
-            logger.info(f"Resuming from pointer: {pointer}")
+            logger.info("Resuming from pointer: %s", pointer)
             return pointer
     except Exception as e:
-        logger.error(f"Error reading pointer file '{filename}': {e}")
+        logger.error("Error reading pointer file '%s': %s", filename, e)
     return None
 
 # Function to save intermediate results
 def save_intermediate_results(results, filename_prefix="missing_results"):
+    """
+    Writes the results to a Parquet file named after their first Wikidata ID, so files never overwrite each other.
+    """
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{filename_prefix}_{timestamp}.csv"
-        pd.concat(results, ignore_index=True).to_csv(filename, index=False)
-        logger.info(f"Saved intermediate results to {filename}.")
+        batch = pd.concat(results, ignore_index=True)
+        filename = f"{filename_prefix}_{batch['person'].iloc[0].rsplit('/', 1)[-1]}.parquet"
+        batch.to_parquet(filename, compression="snappy", index=False)
+        logger.info("Saved intermediate results to %s.", filename)
+        return True
     except Exception as e:
-        logger.error(f"Error saving intermediate results: {e}")
+        logger.error("Error saving intermediate results: %s", e)
+        return False
 
-# Function to process and clean the DataFrame
-def process_results(df):
-    """
-    Extracts the 'value' field from dictionary-like columns in the DataFrame.
-    """
-    for col in df.columns:
-        df[col] = df[col].apply(lambda x: x.get("value", None) if isinstance(x, dict) else x)
-    return df
+# Function to combine the intermediate results into the final CSV
+def save_final_results(filename_prefix, output_csv):
+    files = sorted(glob.glob(f"{filename_prefix}_*.parquet"))
+    if not files:
+        logger.warning("No data fetched.")
+        return
+    try:
+        final_df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+        final_df.to_csv(output_csv, index=False)
+        logger.info("Final data (%d rows from %d files) saved to '%s'.", len(final_df), len(files), output_csv)
+    except Exception as e:
+        logger.error("Error saving final results: %s", e)
 
 # Main function to fetch data for a list of Wikidata IDs
 def fetch_data_for_ids(file_path="missing_persons.csv"):
     # Read the list of Wikidata IDs from the CSV file
     if not os.path.exists(file_path):
-        logger.error(f"File not found: {file_path}")
+        logger.error("File not found: %s", file_path)
         return
 
     try:
-        df = pd.read_csv(file_path)
+        df = read_csv_arrow(file_path)
         if "wikidata_id" not in df.columns:
-            logger.error(f"CSV file must contain a 'wikidata_id' column.")
+            logger.error("CSV file must contain a 'wikidata_id' column.")
             return
-        wikidata_ids = df["wikidata_id"].dropna().apply(lambda x: x.split("/")[-1] if "/" in x else x).tolist()
+        wikidata_ids = df["wikidata_id"].dropna().str.replace(r".*/", "", regex=True)
+        valid = wikidata_ids.str.fullmatch(r"Q\d+")
+        if not valid.all():  # A single malformed ID makes the API reject its whole batch
+            logger.warning("Ignoring %d malformed Wikidata IDs.", (~valid).sum())
+        wikidata_ids = wikidata_ids[valid].tolist()
     except Exception as e:
-        logger.error(f"Error reading CSV file: {e}")
+        logger.error("Error reading CSV file: %s", e)
         return
 
     if not wikidata_ids:
@@ -110,72 +198,53 @@ def fetch_data_for_ids(file_path="missing_persons.csv"):
             last_index = wikidata_ids.index(last_pointer)
             wikidata_ids = wikidata_ids[last_index + 1:]  # Resume from the next ID
         except ValueError:
-            logger.warning(f"Pointer ID '{last_pointer}' not found in the list. Starting from the beginning.")
+            logger.warning("Pointer ID '%s' not found in the list. Starting from the beginning.", last_pointer)
 
     all_results = []
     batch_count = 0
-
-    for wikidata_id in wikidata_ids:
-        logger.info(f"Fetching data for Wikidata ID: {wikidata_id}...")
-
-        query = f"""
-            PREFIX schema: <http://schema.org/>
-            PREFIX wd: <http://www.wikidata.org/entity/>
-            PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-            PREFIX wikibase: <http://wikiba.se/ontology#>
-            PREFIX bd: <http://www.bigdata.com/rdf#>
-            PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-            PREFIX geo: <http://www.opengis.net/ont/geosparql#>
-
-            SELECT ?person ?personLabel ?birthdate ?birthplace ?placeOfDeath ?birthplaceCoordinates
-            WHERE {{
-                BIND(wd:{wikidata_id} AS ?person)  # Specific Wikidata ID
-                ?person wdt:P569 ?birthdate.  # Ensure the person has a birthdate
-                ?person wdt:P19 ?birthplace.  # Birthplace
-                OPTIONAL {{ ?person wdt:P20 ?placeOfDeath. }}  # Place of death (optional)
-                OPTIONAL {{ ?birthplace wdt:P625 ?birthplaceCoordinates. }}  # Geo-coordinates of birthplace
-
-                SERVICE wikibase:label {{
-                    bd:serviceParam wikibase:language "de".
-                    ?person rdfs:label ?personLabel .
-                }}
-            }}
-        """
-
-        batch_results = query_wikidata(query)
-
-        if batch_results is None:  # Query failed after max retries
-            logger.error(f"Failed to fetch data for Wikidata ID: {wikidata_id}. Skipping...")
-            continue
-
-        if batch_results.empty:  # No data for the current ID
-            logger.info(f"No results for Wikidata ID: {wikidata_id}.")
-            continue
-
-        # Process and clean the results
-        batch_results = process_results(batch_results)
-        all_results.append(batch_results)
+    last_id = None
+
+    for i in range(0, len(wikidata_ids), BATCH_SIZE):
+        batch_ids = wikidata_ids[i:i + BATCH_SIZE]
+        logger.info("Fetching data for Wikidata IDs %s to %s (%d IDs)...", batch_ids[0], batch_ids[-1], len(batch_ids))
+
+        persons = get_entities(batch_ids, props="labels|claims")
+        if persons is None:  # Request failed, so stop before the pointer moves past these IDs
+            logger.error("Failed to fetch data for Wikidata IDs %s to %s. Stopping, rerun to resume.", batch_ids[0], batch_ids[-1])
+            break
+
+        # Fetch the birthplaces to read their coordinates
+        birthplace_ids = set()
+        for entity in persons.values():
+            birthplaces = get_claim_values(entity, "P19")
+            if birthplaces:
+                birthplace_ids.add(birthplaces[0]["id"])
+        places = get_entities(sorted(birthplace_ids), props="claims") if birthplace_ids else {}
+        if places is None:
+            logger.error("Failed to fetch birthplaces for Wikidata IDs %s to %s. Stopping, rerun to resume.", batch_ids[0], batch_ids[-1])
+            break
+
+        rows = build_person_rows(persons, places)
+        batch_results = pa.Table.from_pylist(rows, schema=RESULT_SCHEMA).to_pandas(types_mapper=pd.ArrowDtype)
+        last_id = batch_ids[-1]
         batch_count += 1
-        logger.info(f"Fetched {len(batch_results)} records for Wikidata ID: {wikidata_id}.")
 
-        # Save the current ID as the pointer
-        save_pointer(wikidata_id)
+        if batch_results.empty:  # No data for the current batch
+            logger.info("No results for Wikidata IDs %s to %s.", batch_ids[0], batch_ids[-1])
+        else:
+            all_results.append(batch_results)
+            logger.info("Fetched %d records for %d Wikidata IDs.", len(batch_results), len(batch_ids))
 
-        # Save intermediate results periodically
+        # Save intermediate results periodically, moving the pointer only once they are on disk
         if batch_count % SAVE_EVERY_N_BATCHES == 0:
-            save_intermediate_results(all_results, filename_prefix="missing_persons_results")
+            if not all_results or save_intermediate_results(all_results, filename_prefix=RESULTS_PREFIX):
+                save_pointer(last_id)
             all_results = []  # Clear memory to avoid excessive usage
 
-    # Save final results
-    if all_results:
-        try:
-            final_df = pd.concat(all_results, ignore_index=True)
-            final_df.to_csv("missing_persons_geodata.csv", index=False)
-            logger.info("Final data saved to 'missing_persons_geodata.csv'.")
-        except Exception as e:
-            logger.error(f"Error saving final results: {e}")
-    else:
-        logger.warning("No data fetched.")
+    # Save the remaining results, then combine every saved file, including those of earlier runs
+    if batch_count % SAVE_EVERY_N_BATCHES and (not all_results or save_intermediate_results(all_results, filename_prefix=RESULTS_PREFIX)):
+        save_pointer(last_id)
+    save_final_results(RESULTS_PREFIX, "missing_persons_geodata.csv")
 
 if __name__ == "__main__":
     fetch_data_for_ids()
\ No newline at end of file
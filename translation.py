@@ -15,15 +15,20 @@ logger = logging.getLogger(__name__)
 
 # Initialize the DeepL Translator
 translator = deepl.Translator(DEEPL_API_KEY)
-
-def translate_text(text, source_lang="DE", target_lang="EN-US"):
-    """Translates text from source_lang to target_lang using DeepL API."""
-    try:
-        result = translator.translate_text(text, source_lang=source_lang, target_lang=target_lang)
-        return result.text
-    except Exception as e:
-        logger.error(f"Error translating text: {e}")
-        return text
+TRANSLATION_BATCH_SIZE = 50  # texts sent per DeepL request
+
+def translate_texts(texts, source_lang="DE", target_lang="EN-US"):
+    """Translates texts from source_lang to target_lang using DeepL API, returning a text -> translation mapping."""
+    translations = {}
+    for i in range(0, len(texts), TRANSLATION_BATCH_SIZE):
+        batch = texts[i:i + TRANSLATION_BATCH_SIZE]
+        try:
+            results = translator.translate_text(batch, source_lang=source_lang, target_lang=target_lang)
+            translations.update(zip(batch, (result.text for result in results)))
+        except Exception as e:
+            logger.error(f"Error translating batch: {e}")
+            translations.update(zip(batch, batch))  # Keep the original texts
+    return translations
 
 # Check if the required column exists in the dataset
 if 'occupation' not in data.columns:
@@ -32,9 +37,8 @@ if 'occupation' not in data.columns:
 
 # Translate 'occupation' column
 logger.info("Translating 'occupation' column.")
-data['translated_occupation'] = data['occupation'].apply(
-    lambda x: translate_text(x) if pd.notnull(x) else x
-)
+unique_occupations = data['occupation'].dropna().unique().tolist()
+data['translated_occupation'] = data['occupation'].map(translate_texts(unique_occupations))
 
 # Save the translated data to a new csv file
 output_file = 'translated_unique_occupations.csv'
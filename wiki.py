@@ -1,12 +1,14 @@
 import os
+import asyncio
 import pandas as pd
-import requests
+import pyarrow as pa
 import logging
 import datetime
-from time import sleep
 import httpx
+import diskcache
 from dateutil.relativedelta import relativedelta
 import calendar
+from arrow_csv import read_csv_arrow
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,50 +19,112 @@ HEADERS = {
     "User-Agent": "wiki_german_de/1.0 (soc.evgeniiatcoi@gmail.com)",
     "Accept-Encoding": "gzip,deflate"
 }
+WIKIDATA_URL = "https://query.wikidata.org/sparql"
 
-def fetch_wikipedia_data(page_url):
-    """Fetches Wikipedia total page views and description."""
-    if not isinstance(page_url, str) or not page_url.strip():
-        return 0, "No description available"
-    
-    wiki_code = "de" if "de.wikipedia.org" in page_url else "en" if "en.wikipedia.org" in page_url else None
-    if not wiki_code:
-        return 0, "No description available"
-    
-    article = page_url.split("/")[-1]
-    description_url = f"https://{wiki_code}.wikipedia.org/api/rest_v1/page/summary/{article}"
-    total_views = 0
-    description = "No description available"
+MAX_WORKERS = 16  # rows processed concurrently
+WIKIDATA_CONCURRENCY = 5  # caps concurrent queries to the Wikidata endpoint
+CHECKPOINT_EVERY = 100  # rows per checkpoint batch
 
-    # Fetch Description
-    try:
-        response = httpx.get(description_url, timeout=10)
+# Columns added to each input row, with their checkpoint types
+ENRICHED_FIELDS = [
+    ("occupation", pa.string()),
+    ("date_of_death", pa.string()),
+    ("german_total_views", pa.int64()),
+    ("german_description", pa.string()),
+    ("english_total_views", pa.int64()),
+    ("english_description", pa.string())
+]
+
+# On-disk cache of Wikipedia API responses (keyed by URL), pageview totals of completed months,
+# and Wikidata results (keyed by person ID)
+CACHE_EXPIRE = 86400 * 7  # seconds before a cached response is fetched again
+WIKIDATA_CACHE_EXPIRE = 86400 * 30
+_CACHE = diskcache.Cache("wiki_cache")
+
+async def get_json_cached(client, url, expire=CACHE_EXPIRE):
+    """Returns the JSON body of a GET request, reusing the cached response when available."""
+    data = _CACHE.get(url)
+    if data is None:
+        response = await client.get(url)
         response.raise_for_status()
-        summary_data = response.json()
-        description = summary_data.get("extract", "No description available")
+        data = response.json()
+        _CACHE.set(url, data, expire=expire)
+    return data
+
+async def fetch_description(client, wiki_code, article):
+    """Fetches the summary extract of a Wikipedia article."""
+    description_url = f"https://{wiki_code}.wikipedia.org/api/rest_v1/page/summary/{article}"
+    try:
+        summary_data = await get_json_cached(client, description_url)
+        return summary_data.get("extract", "No description available")
     except Exception as e:
-        logger.error(f"Error fetching description for {article}: {e}")
+        logger.error("Error fetching description for %s: %s", article, e)
+        return "No description available"
 
-    # Fetch Total Views (Summing Monthly Data)
+async def fetch_total_views(client, wiki_code, article):
+    """Fetches the total page views of a Wikipedia article by summing monthly data."""
     try:
         current_year = datetime.datetime.now().year
-        start_date = "20150701"  # Earliest available Wikipedia pageview data (July 2015)
+        start_date = datetime.date(2015, 7, 1)  # Earliest available Wikipedia pageview data (July 2015)
         end_date = f"{current_year}1231"  # End of the current year
-        
-        views_url = f"https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/{wiki_code}.wikipedia/all-access/all-agents/{article}/monthly/{start_date}/{end_date}"
-        response = httpx.get(views_url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        month_start = datetime.date.today().replace(day=1)
+        history_end = f"{month_start - datetime.timedelta(days=1):%Y%m%d}"
+
+        views_url = f"https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/{wiki_code}.wikipedia/all-access/all-agents/{article}/monthly"
+
+        # Completed months never change, so only months after the stored cutoff are fetched and added to its total
+        history_key = ("pageviews", wiki_code, article)
+        cutoff, history_total = _CACHE.get(history_key, (None, 0))
+        if cutoff != history_end:
+            window_start = datetime.datetime.strptime(cutoff, "%Y%m%d").date() + datetime.timedelta(days=1) if cutoff else start_date
+            response = await client.get(f"{views_url}/{window_start:%Y%m%d}/{history_end}")
+            if response.status_code != 404:  # 404 means no views in the window
+                response.raise_for_status()
+                items = response.json().get("items", [])
+                if items:
+                    history_total += sum(item["views"] for item in items)
+                    # Move the cutoff only to the last month returned, as a month's data is published a few days late
+                    last_month = datetime.datetime.strptime(max(item["timestamp"] for item in items)[:8], "%Y%m%d").date()
+                    cutoff = f"{last_month + relativedelta(months=1) - datetime.timedelta(days=1):%Y%m%d}"
+                    _CACHE.set(history_key, (cutoff, history_total))
 
-        total_views = sum(item["views"] for item in data.get("items", []))
+        current_total = 0
+        try:
+            current = await get_json_cached(client, f"{views_url}/{month_start:%Y%m%d}/{end_date}")
+            current_total = sum(item["views"] for item in current.get("items", []))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:  # 404 means no data yet for the current month
+                raise
+
+        return history_total + current_total
     except Exception as e:
-        logger.error(f"Error fetching pageviews for {article}: {e}")
+        logger.error("Error fetching pageviews for %s: %s", article, e)
+        return 0
 
+async def fetch_wikipedia_data(client, page_url):
+    """Fetches Wikipedia total page views and description."""
+    if not isinstance(page_url, str) or not page_url.strip():
+        return 0, "No description available"
+    
+    wiki_code = "de" if "de.wikipedia.org" in page_url else "en" if "en.wikipedia.org" in page_url else None
+    if not wiki_code:
+        return 0, "No description available"
+    
+    article = page_url.split("/")[-1]
+    description, total_views = await asyncio.gather(
+        fetch_description(client, wiki_code, article),
+        fetch_total_views(client, wiki_code, article)
+    )
     return total_views, description
 
-def fetch_occupation_and_death(person_id):
+async def fetch_occupation_and_death(client, wikidata_limit, person_id):
     """Fetches occupation and date of death for a given person ID from Wikidata."""
-    logger.info(f"Fetching data for person ID: {person_id}")
+    cache_key = ("occupation_and_death", person_id)
+    cached = _CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    logger.info("Fetching data for person ID: %s", person_id)
     query = f"""
         PREFIX wd: <http://www.wikidata.org/entity/>
         PREFIX wdt: <http://www.wikidata.org/prop/direct/>
@@ -73,83 +137,144 @@ def fetch_occupation_and_death(person_id):
         }}
     """
     try:
-        response = requests.get("https://query.wikidata.org/sparql", params={"query": query, "format": "json"}, headers=HEADERS)
+        async with wikidata_limit:
+            response = await client.get(WIKIDATA_URL, params={"query": query, "format": "json"}, headers=HEADERS, timeout=60)
         response.raise_for_status()
         results = response.json().get("results", {}).get("bindings", [])
         if not results:
-            logger.warning(f"No data found for person ID: {person_id}")
-            return "No occupation found", "No date of death"
+            logger.warning("No data found for person ID: %s", person_id)
+            person_data = "No occupation found", "No date of death"
+        else:
+            occupations = ", ".join([r["occupationLabel"]["value"] for r in results if "occupationLabel" in r])
+            date_of_death = results[0].get("dateOfDeath", {}).get("value", "No date of death")
+            person_data = occupations if occupations else "No occupation found", date_of_death
 
-        occupations = ", ".join([r["occupationLabel"]["value"] for r in results if "occupationLabel" in r])
-        date_of_death = results[0].get("dateOfDeath", {}).get("value", "No date of death")
-        return occupations if occupations else "No occupation found", date_of_death
+        _CACHE.set(cache_key, person_data, expire=WIKIDATA_CACHE_EXPIRE)  # Failed requests are not cached
+        return person_data
     except Exception as e:
-        logger.error(f"Error fetching data for {person_id}: {e}")
+        logger.error("Error fetching data for %s: %s", person_id, e)
         return "No occupation found", "No date of death"
 
-def enrich_data(input_csv, output_csv, checkpoint_csv="checkpoint.csv"):
+async def process_row(client, wikidata_limit, row, person_id):
+    """Fetches occupation, date of death, and Wikipedia data for a single row."""
+    try:
+        person_data, (german_total, german_desc), (english_total, english_desc) = await asyncio.gather(
+            fetch_occupation_and_death(client, wikidata_limit, person_id),  # Fetch occupation and date of death
+            fetch_wikipedia_data(client, row["GermanWikipedia"]),
+            fetch_wikipedia_data(client, row["EnglishWikipedia"])
+        )
+    except Exception as e:
+        logger.error("Error processing row for person ID %s: %s", person_id, e)
+        return None
+
+    enriched_row = dict(row)
+    enriched_row.update({
+        "occupation": person_data[0],
+        "date_of_death": person_data[1],
+        "german_total_views": german_total,
+        "german_description": german_desc,
+        "english_total_views": english_total,
+        "english_description": english_desc
+    })
+    return enriched_row
+
+def checkpoint_schema(df):
+    """Returns the Arrow schema of enriched rows: the input columns plus the fetched fields."""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for name, type_ in ENRICHED_FIELDS:
+        schema = schema.append(pa.field(name, type_))
+    return schema
+
+def load_checkpoint(checkpoint_path, schema):
+    """Reads the rows saved in the checkpoint's streams (one per run), ignoring a batch truncated by a crash."""
+    batches = []
+    try:
+        # Read through OSFile so batches are copied, not memory-mapped, before the file is rewritten
+        with pa.OSFile(checkpoint_path) as source:
+            while source.tell() < source.size():
+                with pa.ipc.open_stream(source) as reader:
+                    for batch in reader:
+                        batches.append(batch)
+    except (pa.ArrowInvalid, OSError) as e:
+        logger.warning("Checkpoint ends with an incomplete batch, keeping %d batches: %s", len(batches), e)
+    return pa.Table.from_batches(batches, schema=schema)
+
+def save_checkpoint(writer, schema, rows):
+    """Appends rows to the checkpoint stream as a single record batch."""
+    if not rows:
+        return
+    try:
+        writer.write_batch(pa.RecordBatch.from_pandas(pd.DataFrame(rows), schema=schema, preserve_index=False))
+        logger.info("Checkpoint saved with %d new rows.", len(rows))
+    except Exception as e:
+        logger.error("Error saving checkpoint: %s", e)
+
+async def process_rows(rows, person_ids, writer, schema):
+    """Processes rows concurrently, appending results to the checkpoint stream as they complete."""
+    row_limit = asyncio.Semaphore(MAX_WORKERS)
+    wikidata_limit = asyncio.Semaphore(WIKIDATA_CONCURRENCY)
+
+    async def limited_row(row, person_id):
+        async with row_limit:
+            return await process_row(client, wikidata_limit, row, person_id)
+
+    async with httpx.AsyncClient(http2=True, timeout=10) as client:
+        tasks = [limited_row(row, person_id) for row, person_id in zip(rows, person_ids)]
+        checkpoint_rows = []
+
+        for completed in asyncio.as_completed(tasks):
+            enriched_row = await completed
+            if enriched_row is None:
+                continue
+            checkpoint_rows.append(enriched_row)
+
+            if len(checkpoint_rows) == CHECKPOINT_EVERY:
+                save_checkpoint(writer, schema, checkpoint_rows)
+                checkpoint_rows = []
+
+        save_checkpoint(writer, schema, checkpoint_rows)
+
+def enrich_data(input_csv, output_csv, checkpoint_path="checkpoint.arrow"):
     """Enriches CSV data with occupation, date of death, and Wikipedia views."""
-    logger.info(f"Processing input CSV: {input_csv}")
+    logger.info("Processing input CSV: %s", input_csv)
     try:
-        df = pd.read_csv(input_csv)
+        df = read_csv_arrow(input_csv)
     except Exception as e:
-        logger.error(f"Error reading input CSV: {e}")
+        logger.error("Error reading input CSV: %s", e)
         return
 
-    enriched_data = []
-    last_processed_index = -1
+    schema = checkpoint_schema(df)
+    checkpoint = schema.empty_table()
 
-    if os.path.exists(checkpoint_csv):
+    if os.path.exists(checkpoint_path):
         logger.info("Resuming from checkpoint.")
         try:
-            checkpoint_df = pd.read_csv(checkpoint_csv)
-            enriched_data = checkpoint_df.to_dict(orient="records")  # Load checkpoint data
-            last_processed_index = len(checkpoint_df) - 1  # Infer last processed row
-            logger.info(f"Resuming from row {last_processed_index + 1}.")
+            checkpoint = load_checkpoint(checkpoint_path, schema)
+            logger.info("Resuming with %d rows already processed.", checkpoint.num_rows)
         except Exception as e:
-            logger.error(f"Error reading checkpoint CSV: {e}")
+            logger.error("Error reading checkpoint: %s", e)
             return
-    else:
-        last_processed_index = -1
 
-    for idx, row in df.iterrows():
-        if idx <= last_processed_index:
-            continue  # Skip rows already processed
+    processed_persons = set(checkpoint.column("person").to_pylist())  # Rows finish out of order, so track persons
+    pending = df[~df["person"].isin(processed_persons)]
+    rows = pending.to_dict(orient="records")
+    person_ids = pending["person"].str.replace(r".*/", "", regex=True).tolist()
+
+    # Rewrite the kept rows through a temp file so a crash never leaves the checkpoint truncated
+    tmp_path = checkpoint_path + ".tmp"
+    with pa.ipc.new_stream(tmp_path, schema) as writer:
+        writer.write_table(checkpoint)
+    os.replace(tmp_path, checkpoint_path)
+
+    # This run's batches are appended as a new stream, so saving a checkpoint never rewrites earlier rows
+    with open(checkpoint_path, "ab") as sink, pa.ipc.new_stream(sink, schema) as writer:
+        asyncio.run(process_rows(rows, person_ids, writer, schema))
 
-        person_id = row["person"].split("/")[-1]
-        try:
-            person_data = fetch_occupation_and_death(person_id)  # Fetch occupation and date of death
-            german_total, german_desc = fetch_wikipedia_data(row["GermanWikipedia"])
-            english_total, english_desc = fetch_wikipedia_data(row["EnglishWikipedia"])
-        except Exception as e:
-            logger.error(f"Error processing row for person ID {person_id}: {e}")
-            continue
-
-        enriched_row = row.to_dict()
-        enriched_row.update({
-            "occupation": person_data[0],
-            "date_of_death": person_data[1],
-            "german_total_views": german_total,
-            "german_description": german_desc,
-            "english_total_views": english_total,
-            "english_description": english_desc
-        })
-        enriched_data.append(enriched_row)
-
-        if len(enriched_data) % 100 == 0:
-            try:
-                pd.DataFrame(enriched_data).to_csv(checkpoint_csv, index=False)
-                logger.info(f"Checkpoint saved at {len(enriched_data)} rows.")
-            except Exception as e:
-                logger.error(f"Error saving checkpoint: {e}")
-
-        sleep(0.3)
-    
     try:
-        pd.DataFrame(enriched_data).to_csv(output_csv, index=False)
-        logger.info(f"Enrichment complete. Data saved to {output_csv}")
+        load_checkpoint(checkpoint_path, schema).to_pandas().to_csv(output_csv, index=False)
+        logger.info("Enrichment complete. Data saved to %s", output_csv)
     except Exception as e:
-        logger.error(f"Error saving output CSV: {e}")
+        logger.error("Error saving output CSV: %s", e)
     
 if __name__ == "__main__":
     enrich_data("final_combined_results.csv", "enriched_final_results.csv")
\ No newline at end of file
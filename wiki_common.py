@@ -0,0 +1,431 @@
+import asyncio
+import httpx
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+import glob
+import queue
+import threading
+import functools
+import random
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Configuration
+BATCH_SIZE = 500
+MAX_RETRIES = 10
+TIMEOUT = 300  # read timeout in seconds
+CONNECT_TIMEOUT = 5
+BACKOFF_BASE = 1.0  # seconds, doubled on every attempt
+BACKOFF_CAP = 60.0  # longest backoff ceiling in seconds
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_THRESHOLD = 3  # consecutive queries that exhaust their retries before the breaker opens
+BREAKER_COOLDOWN = (60, 300)  # seconds the open breaker holds queries back before one probe, picked at random
+CONCURRENT_RANGES = 4  # year ranges queried at once, within Wikidata's per-IP limit
+WRITE_QUEUE_SIZE = 4  # pending disk writes before fetchers wait for the writer thread
+WIKIDATA_URL = "https://query.wikidata.org/sparql"
+HEADERS = {
+    "Accept": "application/sparql-results+json",
+    "User-Agent": "wiki_german_de/1.0 (soc.evgeniiatcoi@gmail.com)",
+    "Accept-Encoding": "gzip,deflate"
+}
+
+# SPARQL queries per crawl; {year_filter} is filled in per range and {pagination_filter} per batch
+QUERY_TEMPLATES = {
+    "birth": """
+        PREFIX schema: <http://schema.org/>
+        PREFIX wd: <http://www.wikidata.org/entity/>
+        PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+        PREFIX geo: <http://www.opengis.net/ont/geosparql#>
+
+        SELECT ?person ?personLabel ?birthdate ?birthplace ?placeOfDeath ?birthplaceCoordinates
+        WHERE {{
+            ?person wdt:P27 wd:Q183.  # People from Germany
+            ?person wdt:P569 ?birthdate.  # Ensure the person has a birthdate
+            ?person wdt:P19 ?birthplace.  # Birthplace
+            OPTIONAL {{ ?person wdt:P20 ?placeOfDeath. }}  # Place of death (optional)
+            OPTIONAL {{ ?birthplace wdt:P625 ?birthplaceCoordinates. }}  # Geo-coordinates of birthplace
+
+            # Birth year filter
+            {year_filter}
+
+            # Ensure the person has a German Wikipedia page (mandatory)
+            ?germanPage schema:about ?person ;
+                        schema:inLanguage "de" ;
+                        schema:isPartOf <https://de.wikipedia.org/> .
+
+            # German label, joined in-band instead of through the label service; falls back to the QID like the service did
+            OPTIONAL {{
+                ?person rdfs:label ?deLabel .
+                FILTER(LANG(?deLabel) = "de")
+            }}
+            BIND(COALESCE(?deLabel, STRAFTER(STR(?person), "entity/")) AS ?personLabel)
+
+            # Pagination using last_birthdate and last_person
+            {pagination_filter}
+        }}
+        ORDER BY ?birthdate ?person
+        LIMIT {batch_size}
+    """,
+    "german_de": """
+        PREFIX schema: <http://schema.org/>
+        PREFIX wd: <http://www.wikidata.org/entity/>
+        PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+
+        SELECT ?person ?personLabel ?birthdate ?genderLabel
+               (COALESCE(?germanPageUrl, "No") AS ?GermanWikipedia)
+               (COALESCE(?englishPageUrl, "No") AS ?EnglishWikipedia)
+        WHERE {{
+            ?person wdt:P27 wd:Q183.  # People from Germany
+            ?person wdt:P569 ?birthdate.  # Ensure the person has a birthdate
+            ?person wdt:P21 ?gender .  # Ensure the person has a gender
+            ?gender rdfs:label ?genderLabel .
+            FILTER(LANG(?genderLabel) = "de")
+
+            # Birth year filter
+            {year_filter}
+
+            # Ensure the person has a German Wikipedia page (mandatory)
+            ?germanPage schema:about ?person ;
+                        schema:inLanguage "de" ;
+                        schema:isPartOf <https://de.wikipedia.org/> .
+            BIND(STR(?germanPage) AS ?germanPageUrl)
+
+            # Check if the person has an English Wikipedia page
+            OPTIONAL {{
+                ?englishPage schema:about ?person ;
+                             schema:inLanguage "en" ;
+                             schema:isPartOf <https://en.wikipedia.org/> .
+                BIND(STR(?englishPage) AS ?englishPageUrl)
+            }}
+
+            # German label, joined in-band instead of through the label service; falls back to the QID like the service did
+            OPTIONAL {{
+                ?person rdfs:label ?deLabel .
+                FILTER(LANG(?deLabel) = "de")
+            }}
+            BIND(COALESCE(?deLabel, STRAFTER(STR(?person), "entity/")) AS ?personLabel)
+
+            # Pagination using last_birthdate and last_person
+            {pagination_filter}
+        }}
+        ORDER BY ?birthdate ?person
+        LIMIT {batch_size}
+    """,
+}
+
+# Output columns per crawl, in a fixed order so appended batches line up
+RESULT_COLUMNS = {
+    "birth": ["person", "personLabel", "birthdate", "birthplace", "placeOfDeath", "birthplaceCoordinates",
+              "birthplaceLongitude", "birthplaceLatitude"],
+    "german_de": ["person", "personLabel", "birthdate", "birthYear", "genderLabel", "GermanWikipedia", "EnglishWikipedia"],
+}
+
+# Columns stored with a narrower type than text
+COLUMN_TYPES = {
+    "birthYear": pa.int16(),
+    "birthplaceLongitude": pa.float32(),
+    "birthplaceLatitude": pa.float32(),
+}
+
+# Circuit breaker state shared by all ranges; a zero deadline means the breaker is closed
+_consec_failures = 0
+_breaker_open_until = 0.0
+_probe_in_flight = False
+_breaker_gave_up = False  # set when a probe fails; every query then fails fast until the next run
+
+# Function to open the circuit breaker for a jittered cooldown
+def open_breaker():
+    global _breaker_open_until, _probe_in_flight
+    cooldown = random.uniform(*BREAKER_COOLDOWN)
+    _breaker_open_until = time.monotonic() + cooldown
+    _probe_in_flight = False
+    logger.error("Opening circuit breaker for %.0f seconds.", cooldown)
+
+# Function to close the circuit breaker after a successful query
+def close_breaker():
+    global _consec_failures, _breaker_open_until, _probe_in_flight
+    if _breaker_open_until:
+        logger.info("Query succeeded. Closing circuit breaker.")
+    _consec_failures = 0
+    _breaker_open_until = 0.0
+    _probe_in_flight = False
+
+# Function to wait while the circuit breaker is open
+async def wait_for_breaker():
+    """
+    Sleeps out the cooldown, then lets a single half-open probe through while the other queries keep waiting.
+    Returns True for the caller that sends the probe.
+    """
+    global _probe_in_flight
+    while _breaker_open_until and not _breaker_gave_up:
+        remaining = _breaker_open_until - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        elif not _probe_in_flight:
+            _probe_in_flight = True
+            logger.info("Circuit breaker half-open. Sending a probe query.")
+            return True
+        else:
+            await asyncio.sleep(1)  # Wait for the probe to close the breaker or give up
+    return False
+
+# Function to query Wikidata
+async def query_wikidata_async(client, query, max_retries=MAX_RETRIES, timeout=TIMEOUT):
+    global _consec_failures, _breaker_gave_up
+    for attempt in range(max_retries):
+        # While the breaker is open, wait instead of adding to a retry storm
+        probe = await wait_for_breaker()
+        if _breaker_gave_up:  # The ranges stop unmarked and resume from their last part on the next run
+            logger.error("Circuit breaker probe failed. Giving up on this query.")
+            return None
+
+        try:
+            logger.info("Attempt %d/%d: Querying Wikidata...", attempt + 1, max_retries)
+            # POST keeps the growing query out of the URL and away from intermediary caches
+            response = await client.post(WIKIDATA_URL, data={"query": query},
+                                         timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT))
+            response.raise_for_status()
+            data = orjson.loads(response.content)  # httpx has already undone gzip/deflate
+            results = data.get("results", {}).get("bindings", [])
+            close_breaker()
+
+            if results:
+                # Unwrap each binding's "value" while building the rows; every value is text, kept as Arrow strings
+                return pd.DataFrame([{k: v.get("value") for k, v in row.items()} for row in results],
+                                    dtype=pd.ArrowDtype(pa.string()))
+            else:
+                return pd.DataFrame()  # Return an empty DataFrame if no results
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in RETRYABLE_STATUSES:
+                logger.error("Request rejected with status %d, not retrying: %s", e.response.status_code, e)
+                if probe:  # The endpoint answered, so only this query is at fault
+                    close_breaker()
+                return None
+            logger.error("Request error (Attempt %d/%d): %s", attempt + 1, max_retries, e)
+            retry_after = e.response.headers.get("Retry-After", "")
+        except (httpx.TransportError, httpx.DecodingError, orjson.JSONDecodeError) as e:
+            # A truncated or garbled body is as transient as a dropped connection
+            logger.error("Request error (Attempt %d/%d): %s", attempt + 1, max_retries, e)
+            retry_after = ""
+
+        if probe:  # The endpoint is still down after a full cooldown, so stop querying until the next run
+            logger.error("Circuit breaker probe failed. Giving up on all queries.")
+            _breaker_gave_up = True
+            return None
+
+        # Capped exponential backoff with full jitter so concurrent ranges don't retry in lockstep
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        if retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        await asyncio.sleep(delay)
+
+    logger.error("Max retries reached. Unable to fetch data.")
+    _consec_failures += 1
+    if _consec_failures >= BREAKER_THRESHOLD and not _breaker_open_until:
+        logger.error("%d queries failed in a row.", _consec_failures)
+        open_breaker()
+    return None
+
+# Function to build the sentinel file name marking a year range as complete, kept with the range's parts
+def done_filename(parts_dir, start_year):
+    return os.path.join(parts_dir, f".done_{start_year}")
+
+# Function to mark a year range as complete so re-runs skip it without querying
+def mark_range_done(parts_dir, start_year):
+    open(done_filename(parts_dir, start_year), "w").close()
+    logger.info("Range %d marked as complete.", start_year)
+
+# Function to build the Arrow schema for a crawl's output columns
+def result_schema(columns):
+    return pa.schema([(c, COLUMN_TYPES.get(c, pa.string())) for c in columns])
+
+# Function to write a batch as its own zstd-compressed Parquet part file, with the pointer in its metadata
+def write_part(batch_results, schema, parts_dir, start_year, part_number, pointer):
+    filename = os.path.join(parts_dir, f"{start_year}_{part_number:06d}.parquet")
+    table = pa.Table.from_pandas(batch_results.reindex(columns=schema.names), schema=schema, preserve_index=False)
+    if pointer:
+        table = table.replace_schema_metadata({**table.schema.metadata, b"last_pointer": pointer.encode()})
+    pq.write_table(table, filename + ".tmp", compression="zstd")
+    os.replace(filename + ".tmp", filename)  # A crash never leaves a half-written part behind
+
+# Function to load the birthdate pointer stored with a range's newest part file
+def load_pointer(parts_dir, start_year):
+    part_files = sorted(glob.glob(os.path.join(parts_dir, f"{start_year}_*.parquet")))
+    if not part_files:
+        return None
+    pointer = (pq.read_schema(part_files[-1]).metadata or {}).get(b"last_pointer")
+    if pointer is None:
+        return None
+    logger.info("Resuming from pointer: %s", pointer.decode())
+    return pointer.decode()
+
+# Function to run queued disk writes in order on a background thread
+def writer_thread(write_q, write_failed):
+    while True:
+        job = write_q.get()
+        if job is None:
+            return
+        try:
+            job()
+        except Exception as e:
+            # Skip everything queued after a failed write so no range is marked done over a missing part
+            logger.error("Write failed, discarding remaining writes: %s", e)
+            write_failed.set()  # Tells the ranges to stop querying
+            while write_q.get() is not None:
+                pass
+            return
+
+# Function to combine all part files into the final CSV
+def combine_parts(parts_dir, output_csv):
+    part_files = sorted(glob.glob(os.path.join(parts_dir, "*.parquet")))
+    if not part_files:
+        return False
+    pa.concat_tables([pq.read_table(f) for f in part_files]).to_pandas().to_csv(output_csv, index=False)
+    return True
+
+# Main function to fetch data
+async def fetch_data_async(template_name, output_csv):
+    query_template = QUERY_TEMPLATES[template_name]
+    columns = RESULT_COLUMNS[template_name]
+    schema = result_schema(columns)
+    parts_dir = os.path.splitext(output_csv)[0] + "_parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(CONCURRENT_RANGES)
+
+    # Disk writes go through a bounded queue to one writer thread, overlapping them with the next requests
+    write_q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    write_failed = threading.Event()
+    stopping = threading.Event()  # set once shutdown starts, so no put is left waiting on a queue nobody drains
+    writer = threading.Thread(target=writer_thread, args=(write_q, write_failed), daemon=True)
+    writer.start()
+
+    # Function to put a job on the write queue, giving up if shutdown starts while the queue is full
+    def put_write(job):
+        while not stopping.is_set():
+            try:
+                write_q.put(job, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    # Function to hand a write to the writer thread without blocking the event loop when the queue is full
+    async def enqueue_write(func, *args):
+        if write_failed.is_set() or stopping.is_set():  # The writer discards everything after a failure
+            return
+        await asyncio.to_thread(put_write, functools.partial(func, *args))
+
+    # Function to fetch every batch of one year range
+    async def process_range(client, start_year):
+        end_year = start_year + 19
+        if os.path.exists(done_filename(parts_dir, start_year)):
+            logger.info("Birth years %d to %d already fetched. Skipping.", start_year, end_year)
+            return
+
+        async with semaphore:
+            logger.info("Fetching data for birth years %d to %d...", start_year, end_year)
+
+            last_pointer = load_pointer(parts_dir, start_year)  # Each range resumes from its own pointer
+            last_birthdate, last_person = (None, None) if not last_pointer else last_pointer.split("|")
+            completed = False
+            # A plain dateTime range lets the endpoint use its index instead of evaluating YEAR() per candidate
+            year_filter = (
+                f'FILTER(?birthdate >= "{start_year}-01-01T00:00:00Z"^^xsd:dateTime'
+                f' && ?birthdate < "{end_year + 1}-01-01T00:00:00Z"^^xsd:dateTime)'
+            )
+            part_number = len(glob.glob(os.path.join(parts_dir, f"{start_year}_*.parquet")))
+
+            while True:
+                if write_failed.is_set():  # Further batches could not be saved
+                    logger.error("Stopping %d-%d after a failed write.", start_year, end_year)
+                    break
+
+                pagination_filter = f'FILTER((?birthdate > "{last_birthdate}"^^xsd:dateTime) || (?birthdate = "{last_birthdate}"^^xsd:dateTime && STR(?person) > "{last_person}"))' if last_birthdate and last_person else ""
+                query = query_template.format(year_filter=year_filter, pagination_filter=pagination_filter, batch_size=BATCH_SIZE)
+
+                batch_results = await query_wikidata_async(client, query)
+
+                if batch_results is None:  # Query failed after max retries
+                    logger.error("Too many failures for %d-%d. Skipping range.", start_year, end_year)
+                    break
+
+                if batch_results.empty:  # No more data for the current year range
+                    logger.info("No more results for %d-%d. Moving to next range.", start_year, end_year)
+                    completed = True
+                    break  # Move to next year range
+
+                # Derive the birth year from the xsd:dateTime string instead of binding YEAR() on the endpoint
+                if "birthYear" in columns:
+                    batch_results["birthYear"] = batch_results["birthdate"].str.slice(0, 4).astype("int16")
+
+                # Split "Point(lon lat)" into float32 columns in one vectorized pass
+                if "birthplaceLongitude" in columns and "birthplaceCoordinates" in batch_results:
+                    coords = batch_results["birthplaceCoordinates"].str.extract(r"Point\((?P<lon>[-\d.eE+]+) (?P<lat>[-\d.eE+]+)\)")
+                    batch_results["birthplaceLongitude"] = coords["lon"].astype("float32")
+                    batch_results["birthplaceLatitude"] = coords["lat"].astype("float32")
+
+                # Extract last birthdate and person for pagination
+                try:
+                    last_row = batch_results.iloc[-1]
+                    last_birthdate, last_person = last_row["birthdate"], last_row["person"]
+                except Exception as e:
+                    logger.error("Error extracting pointer: %s", e)
+                    break
+
+                if pd.notna(last_birthdate) and pd.notna(last_person):
+                    last_pointer = f"{last_birthdate}|{last_person}"
+                else:
+                    logger.warning("Missing or invalid birthdate/person in the last record. Skipping pointer update.")
+
+                # The batch and the pointer past it land in one file, so progress never runs ahead of the data
+                await enqueue_write(write_part, batch_results, schema, parts_dir, start_year, part_number, last_pointer)
+                part_number += 1
+                logger.info("Fetched %d records in this batch...", len(batch_results))
+                logger.info("Pointer updated to: %s", last_pointer)
+
+                # If fewer results than BATCH_SIZE, we've reached the end of the data for this year range
+                if len(batch_results) < BATCH_SIZE:
+                    logger.info("Reached the end of data for %d-%d. Moving to next range.", start_year, end_year)
+                    completed = True
+                    break
+
+            if completed:
+                await enqueue_write(mark_range_done, parts_dir, start_year)  # Queued after the range's last part
+
+    # Query the 20-year periods concurrently; each range paginates independently, multiplexed over HTTP/2
+    limits = httpx.Limits(max_connections=CONCURRENT_RANGES)
+    async with httpx.AsyncClient(http2=True, headers=HEADERS, limits=limits) as client:
+        tasks = [asyncio.create_task(process_range(client, start_year)) for start_year in range(1525, 2026, 20)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # gather does not cancel the other ranges when one fails, so stop them before the writer shuts down
+            stopping.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(write_q.put, None)
+            await asyncio.to_thread(writer.join)
+
+    if write_failed.is_set():
+        logger.error("Crawl stopped after a failed write. Rerun to resume from the saved parts.")
+
+    if combine_parts(parts_dir, output_csv):
+        logger.info("Final data saved to '%s'.", output_csv)
+    else:
+        logger.warning("No data fetched.")
+
+# Function to run one crawl from a script
+def fetch_data(template_name, output_csv):
+    asyncio.run(fetch_data_async(template_name, output_csv))
\ No newline at end of file